@@ -1,15 +1,59 @@
+import selectors
 import socket
 import time
-import json
 import random
 import sys
 
+import msgspec
+
 # 配置
 # server
 SERVER_IP = "127.0.0.1"
 SERVER_PORT = 8888
+# 发送间隔（秒），即每秒 20 帧 update
+TICK_INTERVAL = 0.05
 
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+# 增大内核收发缓冲区，避免广播突发时丢包。Linux 会静默截断到
+# net.core.rmem_max / net.core.wmem_max，需先执行：
+#   sysctl -w net.core.rmem_max=12582912 net.core.wmem_max=12582912
+# macOS 等平台超出上限（kern.ipc.maxsockbuf）时直接报错，此时逐次减半重试，
+# 都失败则保留系统默认值
+SOCK_BUF_SIZE = 8 * 1024 * 1024
+for opt in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+    size = SOCK_BUF_SIZE
+    while size >= 64 * 1024:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, opt, size)
+            break
+        except OSError:
+            size //= 2
+# 只与服务器通信：connect 后用 send/recv，内核不必每次解析目标地址，
+# 也只会收到来自服务器的包
+sock.connect((SERVER_IP, SERVER_PORT))
+
+# 复用编解码器实例，直接读写 bytes，省去 UTF-8 转码（服务器只接受 UTF-8 JSON）
+enc = msgspec.json.Encoder()
+dec = msgspec.json.Decoder()
+# 服务器 broadcast_world（src/main.rs）用 serde_json 紧凑输出世界状态，
+# 固定以此开头，按字节前缀即可识别，无需先解码；格式变化时由解码后的
+# 'players' 判断兜底
+WORLD_PREFIX = b'{"players":'
+
+
+class Motion(msgspec.Struct, gc=False):
+    """update 消息中每帧变化的字段；只含数值字段，不会形成引用环，无需 GC 跟踪"""
+    x: float
+    y: float
+    z: float
+    rx: float
+    ry: float
+    rz: float
+    vx: float
+    vy: float
+    vz: float
+    ts: int
+
 
 # ask user for an optional existing uuid to resume
 EXISTING_UUID = input("如果有历史 uuid，请输入（回车跳过新建）: ").strip()
@@ -28,10 +72,10 @@ if EXISTING_UUID:
     print(f"尝试恢复 uuid: {EXISTING_UUID}")
     # 只发送 UUID，不发送用户名（表示尝试恢复）
     reg = {"type": "register", "uuid": EXISTING_UUID}
-    sock.sendto(json.dumps(reg).encode('utf-8'), (SERVER_IP, SERVER_PORT))
+    sock.send(enc.encode(reg))
     try:
-        resp, _ = sock.recvfrom(4096)
-        r = json.loads(resp.decode('utf-8'))
+        resp = sock.recv(4096)
+        r = dec.decode(resp)
         if isinstance(r, dict) and r.get('action') == 'uuid_not_found':
             print(f"错误: {r.get('message')}")
             print("UUID 不存在，需要创建新账号")
@@ -51,7 +95,8 @@ if EXISTING_UUID:
             vy = state.get('vy', 0.0) or 0.0
             vz = state.get('vz', 0.0) or 0.0
             print(f"恢复成功，uuid={UUID}, 用户名={MY_NAME}")
-    except socket.timeout:
+    # 超时，或已连接的 UDP socket 报告的 ICMP 错误（端口/主机/网络不可达）
+    except OSError:
         print("恢复超时，尝试新建")
         UUID = None
 
@@ -63,18 +108,18 @@ if not UUID:
     print(f"尝试新建用户名: {MY_NAME}")
     
     reg = {"type": "register", "username": MY_NAME}
-    sock.sendto(json.dumps(reg).encode('utf-8'), (SERVER_IP, SERVER_PORT))
+    sock.send(enc.encode(reg))
     try:
-        resp, _ = sock.recvfrom(4096)
-        r = json.loads(resp.decode('utf-8'))
+        resp = sock.recv(4096)
+        r = dec.decode(resp)
         if isinstance(r, dict) and r.get('action') == 'name_conflict':
             suggested = r.get('suggested')
             print(f"服务器建议更名为 {suggested}")
             MY_NAME = input(f"请输入新用户名（回车接收建议 {suggested}）: ").strip() or suggested
             reg = {"type": "register", "username": MY_NAME}
-            sock.sendto(json.dumps(reg).encode('utf-8'), (SERVER_IP, SERVER_PORT))
-            resp, _ = sock.recvfrom(4096)
-            r = json.loads(resp.decode('utf-8'))
+            sock.send(enc.encode(reg))
+            resp = sock.recv(4096)
+            r = dec.decode(resp)
 
         if isinstance(r, dict) and r.get('action') == 'registered':
             UUID = r.get('uuid')
@@ -82,12 +127,12 @@ if not UUID:
         else:
             print("注册失败，继续使用临时用户名")
             UUID = None
-    except socket.timeout:
+    except OSError:
         print("注册无响应，继续使用临时用户名")
         UUID = None
 
 print(f"我是 {MY_NAME}, 开始发送三维位移/旋转/速度数据...")
-# 本地维护最近一次世界状态
+# 本地维护最近一次世界状态（打印时才从最新一帧解码）
 latest_world = {"players": {}}
 
 try:
@@ -96,88 +141,149 @@ try:
     # velocities
 
 
-    last_heartbeat = time.time()
+    # type/uuid 注册后不再变化，预先编码成固定前缀（去掉结尾的 "}"）写入
+    # 复用的发送缓冲区；每帧把可变字段直接编码到前缀之后，并把其开头的
+    # "{" 改写为 ","，整帧不再分配新的 bytes
+    update_buf = bytearray(enc.encode({"type": "update", "uuid": UUID})[:-1])
+    update_prefix_len = len(update_buf)
+    # 可变字段只构造一次，每帧原地改写
+    motion = Motion(
+        x=x,
+        y=y,
+        z=z,
+        rx=rx,
+        ry=ry,
+        rz=rz,
+        vx=vx,
+        vy=vy,
+        vz=vz,
+        ts=0,
+    )
+
+    # 注册完成后切换为非阻塞，由 selector 等待可读，不再每帧 settimeout
+    sock.setblocking(False)
+    sel = selectors.DefaultSelector()
+    sel.register(sock, selectors.EVENT_READ)
+
+    # 预先绑定随机数方法，省去循环内的属性查找
+    rand = random.random
+    uniform = random.uniform
+
+    last_heartbeat_ns = time.time_ns()
+    # 世界状态每秒最多解码、打印一次，避免逐包解析与 print 拖慢收发；
+    # 其余时间只保留最新一帧原始数据
+    last_world_log_ns = 0
+    world_raw = None
+    next_tick = time.monotonic()
     while True:
+        # 每帧只取一次时钟，ts 与心跳判断共用
+        now_ns = time.time_ns()
+
         # 简单物理积分：位置 += 速度
         x += vx
         y += vy
         z += vz
 
         # 随机扰动速度与朝向，模拟控制输入
-        if random.random() < 0.2:
-            vx += random.uniform(-0.05, 0.05)
-            vy += random.uniform(-0.05, 0.05)
-            vz += random.uniform(-0.05, 0.05)
-            rx += random.uniform(-1.0, 1.0)
-            ry += random.uniform(-1.0, 1.0)
-            rz += random.uniform(-1.0, 1.0)
-
-        ts = int(time.time() * 1000)
-        payload = {
-            "type": "update",
-            "uuid": UUID,
-            "x": x,
-            "y": y,
-            "z": z,
-            "rx": rx,
-            "ry": ry,
-            "rz": rz,
-            "vx": vx,
-            "vy": vy,
-            "vz": vz,
-            "ts": ts,
-        }
-
-        sock.sendto(json.dumps(payload).encode('utf-8'), (SERVER_IP, SERVER_PORT))
-
-        # 接收服务器回传的世界状态或控制消息
-        sock.settimeout(0.1)
+        if rand() < 0.2:
+            vx += uniform(-0.05, 0.05)
+            vy += uniform(-0.05, 0.05)
+            vz += uniform(-0.05, 0.05)
+            rx += uniform(-1.0, 1.0)
+            ry += uniform(-1.0, 1.0)
+            rz += uniform(-1.0, 1.0)
+
+        ts = now_ns // 1_000_000
+        motion.x = x
+        motion.y = y
+        motion.z = z
+        motion.rx = rx
+        motion.ry = ry
+        motion.rz = rz
+        motion.vx = vx
+        motion.vy = vy
+        motion.vz = vz
+        motion.ts = ts
+
+        # encode_into 会把缓冲区截断到恰好的长度，可直接整体发送
+        enc.encode_into(motion, update_buf, update_prefix_len)
+        update_buf[update_prefix_len] = ord(",")
+        # 已连接的 UDP socket 也会在 send 时报告之前收到的 ICMP 错误
+        # （端口/主机/网络不可达），服务器不可达时忽略，继续发送
         try:
-            response, _ = sock.recvfrom(4096)
-            payload = json.loads(response.decode('utf-8'))
-            # 名称冲突提示
-            if isinstance(payload, dict) and payload.get('action') == 'name_conflict':
-                suggested = payload.get('suggested')
-                if suggested:
-                    print(f"服务器: 名称冲突，建议使用 {suggested}")
-                    MY_ID = suggested
-            # 世界状态
-            elif isinstance(payload, dict) and 'players' in payload:
-                latest_world = payload
-                players = latest_world.get('players', {})
-                print(f"服务器返回世界状态: {len(players)} 个玩家在线")
-                # 打印每个玩家的 transform/velocity 简短信息
-                for pid, p in players.items():
-                    uname = p.get('username')
-                    print(f"{pid} ({uname})", {k: p.get(k) for k in ['x','y','z','rx','ry','rz','vx','vy','vz']})
-            # 服务器要求纠正客户端位置
-            elif isinstance(payload, dict) and payload.get('action') == 'correction':
-                corr = payload.get('corrected')
-                if isinstance(corr, dict) and corr.get('uuid') == UUID:
-                    # apply correction
-                    x = corr.get('x', x)
-                    y = corr.get('y', y)
-                    z = corr.get('z', z)
-                    vx = corr.get('vx', vx)
-                    vy = corr.get('vy', vy)
-                    vz = corr.get('vz', vz)
-                    print(f"收到纠正：位置 -> ({x},{y},{z}), 速度 -> ({vx},{vy},{vz})")
-            else:
-                print("收到未知消息:", payload)
-        except socket.timeout:
+            sock.send(update_buf)
+        except OSError:
             pass
 
+        # 本帧截止时间按单调时钟推进，不受墙上时钟跳变影响
+        next_tick += TICK_INTERVAL
+
+        # 接收服务器回传的世界状态或控制消息；最多等到本帧截止时间，
+        # 有包到达后把接收队列一次取完，避免广播在内核中积压
+        if sel.select(timeout=max(0.0, next_tick - time.monotonic())):
+            try:
+                while True:
+                    response = sock.recv(4096)
+                    # 世界状态：只保留最新一帧，稍后按需解码
+                    if response.startswith(WORLD_PREFIX):
+                        world_raw = response
+                        continue
+                    payload = dec.decode(response)
+                    # 名称冲突提示
+                    if isinstance(payload, dict) and payload.get('action') == 'name_conflict':
+                        suggested = payload.get('suggested')
+                        if suggested:
+                            print(f"服务器: 名称冲突，建议使用 {suggested}")
+                            MY_ID = suggested
+                    # 未匹配前缀的世界状态，同样只保留最新一帧
+                    elif isinstance(payload, dict) and 'players' in payload:
+                        world_raw = response
+                    # 服务器要求纠正客户端位置
+                    elif isinstance(payload, dict) and payload.get('action') == 'correction':
+                        corr = payload.get('corrected')
+                        if isinstance(corr, dict) and corr.get('uuid') == UUID:
+                            # apply correction
+                            x = corr.get('x', x)
+                            y = corr.get('y', y)
+                            z = corr.get('z', z)
+                            vx = corr.get('vx', vx)
+                            vy = corr.get('vy', vy)
+                            vz = corr.get('vz', vz)
+                            print(f"收到纠正：位置 -> ({x},{y},{z}), 速度 -> ({vx},{vy},{vz})")
+                    else:
+                        print("收到未知消息:", payload)
+            # 队列已取空（BlockingIOError）；服务器不可达时，已连接的 UDP socket
+            # 会在读取时报告 ICMP 错误（端口/主机/网络不可达）
+            except OSError:
+                pass
+
+        if world_raw is not None and now_ns - last_world_log_ns > 1_000_000_000:
+            last_world_log_ns = now_ns
+            latest_world = dec.decode(world_raw)
+            world_raw = None
+            players = latest_world.get('players', {})
+            print(f"服务器返回世界状态: {len(players)} 个玩家在线")
+            # 打印每个玩家的 transform/velocity 简短信息
+            for pid, p in players.items():
+                uname = p.get('username')
+                print(f"{pid} ({uname})", {k: p.get(k) for k in ['x','y','z','rx','ry','rz','vx','vy','vz']})
+
         # heartbeat every 30s
-        now = time.time()
-        if UUID and now - last_heartbeat > 30:
+        if UUID and now_ns - last_heartbeat_ns > 30_000_000_000:
             hb = {"type": "heartbeat", "uuid": UUID}
             try:
-                sock.sendto(json.dumps(hb).encode('utf-8'), (SERVER_IP, SERVER_PORT))
+                sock.send(enc.encode(hb))
             except Exception:
                 pass
-            last_heartbeat = now
+            last_heartbeat_ns = now_ns
 
-        time.sleep(0.05)
+        # 只睡本帧剩余时间，扣除收发与打印耗时，保持发送频率稳定；
+        # 已经落后时从当前时刻重新计时，不做追赶
+        slack = next_tick - time.monotonic()
+        if slack > 0:
+            time.sleep(slack)
+        else:
+            next_tick = time.monotonic()
 except KeyboardInterrupt:
     print("退出")
 finally: